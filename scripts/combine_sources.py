@@ -9,11 +9,43 @@ Example:
     python combine_sources.py --db ~/claude_metrics.db
 """
 
+import os
 import json
 import sqlite3
 import argparse
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+# orjson is optional; it decodes session JSONL several times faster
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Size of the raw reads used when scanning session JSONL files
+READ_CHUNK_SIZE = 1 << 20
+
+# Least unread session data worth a worker pool; below this, starting
+# the workers costs more than parsing the new lines in-process
+PARALLEL_PARSE_MIN_BYTES = 8 << 20
+
+# Shared stand-in for entries without usage info; never mutated
+_EMPTY_USAGE = {}
+
+# One SQL string for every batch so its prepared statement is reused
+# from the connection's cache, which is keyed on the SQL text
+_INSERT_SQL = '''
+    INSERT OR IGNORE INTO session_messages 
+    (msg_uid, session_id, role, content_preview, tool_use, 
+     usage_input_tokens, usage_output_tokens, 
+     usage_cache_read, usage_cache_creation)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+_PROGRESS_SQL = 'INSERT OR REPLACE INTO session_file_progress VALUES (?, ?, ?)'
 
 
 def create_messages_table(conn):
@@ -30,107 +62,252 @@ def create_messages_table(conn):
             usage_input_tokens INTEGER,
             usage_output_tokens INTEGER,
             usage_cache_read INTEGER,
-            usage_cache_creation INTEGER
+            usage_cache_creation INTEGER,
+            msg_uid TEXT  -- <file path under projects dir>:<line number>
         )
     ''')
+    
+    # Databases created before msg_uid existed need the column added
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(session_messages)')}
+    if 'msg_uid' not in columns:
+        cursor.execute('ALTER TABLE session_messages ADD COLUMN msg_uid TEXT')
+    
+    # Unlike the other indexes this one must exist during the load,
+    # since INSERT OR IGNORE relies on it to skip already-merged lines
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_uid ON session_messages(msg_uid)
+    ''')
+    
+    # How far each session file has been merged, so re-runs resume there.
+    # Files are keyed by path, since session IDs (file stems) can repeat
+    # across project directories
     cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_messages_session ON session_messages(session_id)
+        CREATE TABLE IF NOT EXISTS session_file_progress (
+            file_key TEXT PRIMARY KEY,
+            byte_offset INTEGER,
+            line_count INTEGER
+        )
     ''')
     conn.commit()
 
 
-def parse_session_jsonl(jsonl_path):
-    """Parse a session JSONL file."""
-    entries = []
-    with open(jsonl_path, 'r') as f:
-        for line in f:
-            if line.strip():
-                try:
-                    entries.append(json.loads(line))
-                except json.JSONDecodeError:
-                    continue
-    return entries
+def finalize_indexes(conn):
+    """Create session_messages indexes once the bulk load is done."""
+    conn.executescript('''
+        CREATE INDEX IF NOT EXISTS idx_messages_session ON session_messages(session_id);
+        CREATE INDEX IF NOT EXISTS idx_messages_role ON session_messages(role);
+        CREATE INDEX IF NOT EXISTS idx_messages_tool ON session_messages(tool_use)
+            WHERE tool_use IS NOT NULL;
+    ''')
+
+
+def _decode_jsonl_line(line):
+    """Decode one JSONL line, returning None if it is blank or malformed."""
+    if not line.strip():
+        return None
+    try:
+        return _json_loads(line)
+    except ValueError:
+        # JSONDecodeError (stdlib and orjson) and UnicodeDecodeError
+        return None
+
+
+def iter_session_jsonl(jsonl_path, start_offset=0, start_line=0):
+    """Yield (line_no, end_offset, entry) for each parsed line, skipping bad lines.
+    
+    Reading starts at byte start_offset with lines numbered from
+    start_line. end_offset is the byte offset just past the line's
+    newline, or None for a final line that is not newline-terminated.
+    """
+    line_no = start_line
+    offset = start_offset
+    buf = b''
+    with open(jsonl_path, 'rb') as f:
+        f.seek(start_offset)
+        # Read large raw chunks and split lines ourselves; both decoders
+        # accept bytes, so no separate text decoding pass is needed
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            buf += chunk
+            *lines, buf = buf.split(b'\n')
+            for line in lines:
+                offset += len(line) + 1
+                entry = _decode_jsonl_line(line)
+                if entry is not None:
+                    yield line_no, offset, entry
+                line_no += 1
+    
+    # Last line may not be newline-terminated (e.g. still being written)
+    entry = _decode_jsonl_line(buf)
+    if entry is not None:
+        yield line_no, None, entry
+
+
+def get_projects_dir():
+    """Return the directory Claude Code saves session JSONL files under."""
+    return Path.home() / '.claude' / 'projects'
+
+
+def iter_session_files():
+    """Lazily yield all session JSONL files."""
+    claude_dir = get_projects_dir()
+    # Probe the directory once; a missing tree simply yields nothing
+    try:
+        with os.scandir(claude_dir):
+            pass
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    
+    yield from claude_dir.rglob('*.jsonl')
+
+
+def parse_session_file(jsonl_path, file_key, start_offset=0, start_line=0):
+    """Parse a session JSONL file into session_messages row tuples.
+    
+    file_key identifies the file in msg_uid. Returns (rows, end_offset,
+    end_line): the position after the last complete line parsed, to
+    resume from on the next merge.
+    """
+    session_id = jsonl_path.stem
+    end_offset, end_line = start_offset, start_line
+    rows = []
+    for line_no, line_end, entry in iter_session_jsonl(jsonl_path, start_offset, start_line):
+        role = entry.get('role', 'unknown')
+        content = entry.get('content', '')
+        tool_use = None
+        
+        # Handle content that might be a list: preview the first
+        # item and pick up the first tool_use in the same pass
+        if isinstance(content, list):
+            items = content
+            content = ''
+            for i, item in enumerate(items):
+                is_dict = isinstance(item, dict)
+                if i == 0:
+                    content = item.get('text', str(item)) if is_dict else str(item)
+                if is_dict and item.get('type') == 'tool_use':
+                    tool_use = item.get('name', 'unknown_tool')
+                    break
+        
+        content_preview = content[:200] if content else ''
+        
+        usage = entry.get('usage') or _EMPTY_USAGE
+        rows.append((
+            f"{file_key}:{line_no}", session_id, role, content_preview, tool_use,
+            usage.get('input_tokens', 0),
+            usage.get('output_tokens', 0),
+            usage.get('cache_read_input_tokens', 0),
+            usage.get('cache_creation_input_tokens', 0)
+        ))
+        if line_end is not None:
+            end_offset, end_line = line_end, line_no + 1
+    return rows, end_offset, end_line
 
 
-def find_session_files():
-    """Find all session JSONL files."""
-    claude_dir = Path.home() / '.claude' / 'projects'
-    if not claude_dir.exists():
-        return []
+def iter_merge_jobs(progress):
+    """Yield a (jsonl_path, file_key, start_offset, start_line) job per session file.
     
-    return list(claude_dir.glob('**/*.jsonl'))
+    progress maps file keys to their recorded (byte_offset, line_count).
+    """
+    projects_dir = get_projects_dir()
+    for jsonl_path in iter_session_files():
+        file_key = jsonl_path.relative_to(projects_dir).as_posix()
+        start_offset, start_line = progress.get(file_key, (0, 0))
+        # A file smaller than the recorded offset was rewritten; start over
+        if os.path.getsize(jsonl_path) < start_offset:
+            start_offset = start_line = 0
+        yield jsonl_path, file_key, start_offset, start_line
 
 
-def extract_usage_from_entry(entry):
-    """Extract usage info from a JSONL entry."""
-    usage = entry.get('usage', {})
-    return {
-        'input_tokens': usage.get('input_tokens', 0),
-        'output_tokens': usage.get('output_tokens', 0),
-        'cache_read': usage.get('cache_read_input_tokens', 0),
-        'cache_creation': usage.get('cache_creation_input_tokens', 0)
-    }
+def parse_merge_job(job):
+    """Parse one iter_merge_jobs job, returning (job, rows, end_offset, end_line)."""
+    return (job, *parse_session_file(*job))
+
+
+def iter_merge_results(jobs):
+    """Yield parse_merge_job results, in a worker pool only for large merges.
+    
+    The pool is fed a few files per worker at a time, so only that many
+    files' rows are ever held in memory and jobs are still discovered
+    as the merge goes; results keep job order.
+    """
+    workers = os.cpu_count() or 1
+    if workers == 1:
+        yield from map(parse_merge_job, jobs)
+        return
+    
+    # Look ahead only until enough unread data has turned up to pay for
+    # the pool; re-runs that only pick up new lines stay in-process
+    pending = []
+    unread = 0
+    for job in jobs:
+        pending.append(job)
+        jsonl_path, _, start_offset, _ = job
+        unread += os.path.getsize(jsonl_path) - start_offset
+        if unread >= PARALLEL_PARSE_MIN_BYTES:
+            remaining = chain(pending, jobs)
+            window_size = 2 * workers
+            with ProcessPoolExecutor(workers) as executor:
+                for window in iter(lambda: list(islice(remaining, window_size)), []):
+                    yield from executor.map(parse_merge_job, window)
+            return
+    yield from map(parse_merge_job, pending)
 
 
 def merge_data(db_path):
     """Merge OTEL metrics with session JSONL data."""
     conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-65536')
     create_messages_table(conn)
     cursor = conn.cursor()
     
-    session_files = find_session_files()
+    cursor.execute('SELECT file_key, byte_offset, line_count FROM session_file_progress')
+    progress = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    
+    file_count = 0
+    new_entries = 0
+    file_progress = []
+    # Large merges are parsed in worker processes; only this process
+    # touches SQLite, loading everything in one transaction so it syncs once
+    with conn:
+        results = iter_merge_results(iter_merge_jobs(progress))
+        for (jsonl_path, file_key, start_offset, _), rows, end_offset, end_line in results:
+            file_count += 1
+            if file_key not in progress:
+                # First merge of this file: rows merged for its session
+                # before msg_uid existed would not match the new uids
+                cursor.execute(
+                    'DELETE FROM session_messages WHERE session_id = ? AND msg_uid IS NULL',
+                    (jsonl_path.stem,)
+                )
+            elif start_offset < progress[file_key][0]:
+                # Rewritten file: its old lines would shadow the new ones.
+                # A range (';' sorts right after ':') keeps idx_messages_uid usable
+                cursor.execute(
+                    'DELETE FROM session_messages WHERE msg_uid >= ? AND msg_uid < ?',
+                    (f"{file_key}:", f"{file_key};")
+                )
+            if rows:
+                cursor.executemany(_INSERT_SQL, rows)
+                new_entries += cursor.rowcount
+            file_progress.append((file_key, end_offset, end_line))
+        # One statement for all files' resume points, in the same transaction
+        cursor.executemany(_PROGRESS_SQL, file_progress)
+    
+    # Building indexes after the load avoids per-row B-tree maintenance
+    finalize_indexes(conn)
+    conn.close()
     
-    if not session_files:
+    if not file_count:
         print("No session JSONL files found in ~/.claude/projects/")
         print("Make sure you have Claude Code sessions saved locally.")
-        conn.close()
         return
     
-    total_entries = 0
-    for jsonl_file in session_files:
-        session_id = jsonl_file.stem
-        entries = parse_session_jsonl(jsonl_file)
-        
-        for entry in entries:
-            role = entry.get('role', 'unknown')
-            content = entry.get('content', '')
-            
-            # Handle content that might be a list
-            if isinstance(content, list):
-                if content and isinstance(content[0], dict):
-                    content = content[0].get('text', str(content[0]))
-                else:
-                    content = str(content[0]) if content else ''
-            
-            content_preview = content[:200] if content else ''
-            
-            # Extract tool use info
-            tool_use = None
-            if isinstance(entry.get('content'), list):
-                for item in entry.get('content', []):
-                    if isinstance(item, dict) and item.get('type') == 'tool_use':
-                        tool_use = item.get('name', 'unknown_tool')
-                        break
-            
-            # Extract usage
-            usage = extract_usage_from_entry(entry)
-            
-            cursor.execute('''
-                INSERT INTO session_messages 
-                (session_id, role, content_preview, tool_use, 
-                 usage_input_tokens, usage_output_tokens, 
-                 usage_cache_read, usage_cache_creation)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                session_id, role, content_preview, tool_use,
-                usage['input_tokens'], usage['output_tokens'],
-                usage['cache_read'], usage['cache_creation']
-            ))
-            total_entries += 1
-    
-    conn.commit()
-    conn.close()
-    print(f"Merged {len(session_files)} session files with {total_entries} total entries")
+    print(f"Merged {file_count} session files with {new_entries} new entries")
 
 
 def generate_combined_report(db_path):
@@ -156,13 +333,20 @@ def generate_combined_report(db_path):
     # Session JSONL summary
     report.append("\n## Session JSONL Summary\n")
     
-    cursor.execute('SELECT COUNT(DISTINCT session_id) FROM session_messages')
-    result = cursor.fetchone()[0]
-    report.append(f"- **JSONL Sessions**: {result}")
-    
-    cursor.execute('SELECT COUNT(*) FROM session_messages')
-    result = cursor.fetchone()[0]
-    report.append(f"- **Total Messages**: {result:,}")
+    # Session counts and token totals in a single scan
+    cursor.execute('''
+        SELECT 
+            COUNT(DISTINCT session_id) as sessions,
+            COUNT(*) as messages,
+            SUM(usage_input_tokens) as input,
+            SUM(usage_output_tokens) as output,
+            SUM(usage_cache_read) as cache_read,
+            SUM(usage_cache_creation) as cache_creation
+        FROM session_messages
+    ''')
+    totals = cursor.fetchone()
+    report.append(f"- **JSONL Sessions**: {totals[0]}")
+    report.append(f"- **Total Messages**: {totals[1]:,}")
     
     cursor.execute('''
         SELECT role, COUNT(*) as count
@@ -173,21 +357,12 @@ def generate_combined_report(db_path):
         report.append(f"- **{row[0]} messages**: {row[1]:,}")
     
     # Token usage from JSONL (if available)
-    cursor.execute('''
-        SELECT 
-            SUM(usage_input_tokens) as input,
-            SUM(usage_output_tokens) as output,
-            SUM(usage_cache_read) as cache_read,
-            SUM(usage_cache_creation) as cache_creation
-        FROM session_messages
-    ''')
-    row = cursor.fetchone()
-    if row[0]:
+    if totals[2]:
         report.append("\n## Token Usage from JSONL\n")
-        report.append(f"- **Input Tokens**: {row[0]:,}")
-        report.append(f"- **Output Tokens**: {row[1]:,}")
-        report.append(f"- **Cache Read Tokens**: {row[2]:,}")
-        report.append(f"- **Cache Creation Tokens**: {row[3]:,}")
+        report.append(f"- **Input Tokens**: {totals[2]:,}")
+        report.append(f"- **Output Tokens**: {totals[3]:,}")
+        report.append(f"- **Cache Read Tokens**: {totals[4]:,}")
+        report.append(f"- **Cache Creation Tokens**: {totals[5]:,}")
     
     # Tool usage
     cursor.execute('''
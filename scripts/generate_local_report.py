@@ -9,11 +9,15 @@ Example:
     python generate_local_report.py --db ~/claude_metrics.db --output report.md
 """
 
+import sys
 import sqlite3
 import argparse
 from datetime import datetime
 from pathlib import Path
 
+# Number of sessions listed in the report's Session Details table
+SESSION_DETAIL_LIMIT = 20
+
 
 def get_summary_stats(cursor):
     """Get overall summary statistics."""
@@ -30,6 +34,7 @@ def get_summary_stats(cursor):
         GROUP BY token_type
     ''')
     stats['tokens_by_type'] = dict(cursor.fetchall())
+    stats['total_tokens'] = sum(stats['tokens_by_type'].values())
     
     # Total cost
     cursor.execute('SELECT SUM(value) FROM cost_usage')
@@ -60,29 +65,49 @@ def get_summary_stats(cursor):
     return stats
 
 
-def get_session_details(cursor):
-    """Get detailed session information."""
+def get_session_details(cursor, limit=None):
+    """Get detailed session information, newest first, up to limit rows."""
     cursor.execute('''
         SELECT 
             s.session_id,
             s.model,
             s.started_at,
-            COALESCE(SUM(CASE WHEN t.token_type = 'input' THEN t.value ELSE 0 END), 0) as input_tokens,
-            COALESCE(SUM(CASE WHEN t.token_type = 'output' THEN t.value ELSE 0 END), 0) as output_tokens,
-            COALESCE(SUM(CASE WHEN t.token_type = 'cacheRead' THEN t.value ELSE 0 END), 0) as cache_read,
-            COALESCE(SUM(CASE WHEN t.token_type = 'cacheCreation' THEN t.value ELSE 0 END), 0) as cache_creation,
-            COALESCE((SELECT SUM(value) FROM cost_usage WHERE session_id = s.session_id), 0) as cost,
-            COALESCE((SELECT SUM(value) FROM active_time WHERE session_id = s.session_id), 0) as active_seconds
+            COALESCE(t.input_tokens, 0) as input_tokens,
+            COALESCE(t.output_tokens, 0) as output_tokens,
+            COALESCE(t.cache_read, 0) as cache_read,
+            COALESCE(t.cache_creation, 0) as cache_creation,
+            COALESCE(c.cost, 0) as cost,
+            COALESCE(a.active_seconds, 0) as active_seconds
         FROM sessions s
-        LEFT JOIN token_usage t ON s.session_id = t.session_id
-        GROUP BY s.session_id
+        -- Aggregate each table once per session instead of per outer row
+        LEFT JOIN (
+            SELECT 
+                session_id,
+                SUM(CASE WHEN token_type = 'input' THEN value ELSE 0 END) as input_tokens,
+                SUM(CASE WHEN token_type = 'output' THEN value ELSE 0 END) as output_tokens,
+                SUM(CASE WHEN token_type = 'cacheRead' THEN value ELSE 0 END) as cache_read,
+                SUM(CASE WHEN token_type = 'cacheCreation' THEN value ELSE 0 END) as cache_creation
+            FROM token_usage
+            GROUP BY session_id
+        ) t ON t.session_id = s.session_id
+        LEFT JOIN (
+            SELECT session_id, SUM(value) as cost
+            FROM cost_usage
+            GROUP BY session_id
+        ) c ON c.session_id = s.session_id
+        LEFT JOIN (
+            SELECT session_id, SUM(value) as active_seconds
+            FROM active_time
+            GROUP BY session_id
+        ) a ON a.session_id = s.session_id
         ORDER BY s.started_at DESC
-    ''')
+        LIMIT ?
+    ''', (-1 if limit is None else limit,))
     
     columns = ['session_id', 'model', 'started_at', 'input_tokens', 'output_tokens', 
                'cache_read', 'cache_creation', 'cost', 'active_seconds']
     
-    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return [dict(zip(columns, row)) for row in cursor]
 
 
 def calculate_cache_metrics(cursor):
@@ -114,77 +139,88 @@ def calculate_cache_metrics(cursor):
     return metrics
 
 
-def generate_markdown_report(stats, sessions, cache_metrics):
-    """Generate a markdown report."""
-    report = []
-    
-    report.append("# Claude Code Local Metrics Report")
-    report.append(f"\n**Generated**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-    
-    # Summary section
-    report.append("## Summary\n")
-    report.append(f"- **Total Sessions**: {stats['total_sessions']}")
-    report.append(f"- **Total Cost**: ${stats['total_cost']:.4f}")
-    report.append(f"- **Total Active Time**: {stats['total_active_time']:.1f} seconds ({stats['total_active_time']/60:.1f} minutes)")
+def generate_markdown_report(stats, sessions, cache_metrics, out):
+    """Write a markdown report to the writable file object out."""
+    write = out.write
+    tokens_by_type = stats['tokens_by_type']
+    active_time = stats['total_active_time']
+    
+    # Header and summary section
+    write(
+        "# Claude Code Local Metrics Report\n"
+        f"\n**Generated**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+        "## Summary\n\n"
+        f"- **Total Sessions**: {stats['total_sessions']}\n"
+        f"- **Total Cost**: ${stats['total_cost']:.4f}\n"
+        f"- **Total Active Time**: {active_time:.1f} seconds ({active_time/60:.1f} minutes)\n"
+    )
     
     # Token usage
-    report.append("\n## Token Usage\n")
-    report.append("| Type | Count |")
-    report.append("|------|-------|")
-    for token_type, count in stats['tokens_by_type'].items():
-        report.append(f"| {token_type} | {count:,} |")
-    
-    total_tokens = sum(stats['tokens_by_type'].values()) if stats['tokens_by_type'] else 0
-    report.append(f"| **Total** | **{total_tokens:,}** |")
+    write(
+        "\n## Token Usage\n\n"
+        "| Type | Count |\n"
+        "|------|-------|\n"
+    )
+    for token_type, count in tokens_by_type.items():
+        write(f"| {token_type} | {count:,} |\n")
+    write(f"| **Total** | **{stats['total_tokens']:,}** |\n")
     
     # Cost by model
     if stats['cost_by_model']:
-        report.append("\n## Cost by Model\n")
-        report.append("| Model | Cost (USD) |")
-        report.append("|-------|------------|")
+        write(
+            "\n## Cost by Model\n\n"
+            "| Model | Cost (USD) |\n"
+            "|-------|------------|\n"
+        )
         for model, cost in stats['cost_by_model'].items():
-            report.append(f"| {model} | ${cost:.4f} |")
+            write(f"| {model} | ${cost:.4f} |\n")
     
     # Cache metrics
-    report.append("\n## Cache Efficiency\n")
-    report.append(f"- **Cache Read Tokens**: {cache_metrics['cache_read_tokens']:,}")
-    report.append(f"- **Cache Creation Tokens**: {cache_metrics['cache_creation_tokens']:,}")
-    report.append(f"- **Cache Hit Ratio**: {cache_metrics['cache_hit_ratio']*100:.1f}%")
-    report.append(f"- **Cache Efficiency**: {cache_metrics['cache_efficiency']*100:.1f}%")
-    report.append(f"- **Cache Read:Creation Ratio**: {cache_metrics['cache_read_creation_ratio']:.1f}:1")
-    report.append(f"- **Estimated Cost Savings**: ${cache_metrics['estimated_savings']:.4f}")
+    write(
+        "\n## Cache Efficiency\n\n"
+        f"- **Cache Read Tokens**: {cache_metrics['cache_read_tokens']:,}\n"
+        f"- **Cache Creation Tokens**: {cache_metrics['cache_creation_tokens']:,}\n"
+        f"- **Cache Hit Ratio**: {cache_metrics['cache_hit_ratio']*100:.1f}%\n"
+        f"- **Cache Efficiency**: {cache_metrics['cache_efficiency']*100:.1f}%\n"
+        f"- **Cache Read:Creation Ratio**: {cache_metrics['cache_read_creation_ratio']:.1f}:1\n"
+        f"- **Estimated Cost Savings**: ${cache_metrics['estimated_savings']:.4f}\n"
+    )
     
     # Session details
-    report.append("\n## Session Details\n")
-    report.append("| Session ID | Model | Input | Output | Cache Read | Cost |")
-    report.append("|------------|-------|-------|--------|------------|------|")
-    for session in sessions[:20]:  # Limit to 20 sessions
-        session_short = session['session_id'][:8] + '...' if len(session['session_id']) > 12 else session['session_id']
-        report.append(f"| {session_short} | {session['model']} | {session['input_tokens']:,} | {session['output_tokens']:,} | {session['cache_read']:,} | ${session['cost']:.4f} |")
-    
-    if len(sessions) > 20:
-        report.append(f"\n*Showing 20 of {len(sessions)} sessions*")
+    write(
+        "\n## Session Details\n\n"
+        "| Session ID | Model | Input | Output | Cache Read | Cost |\n"
+        "|------------|-------|-------|--------|------------|------|\n"
+    )
+    for session in sessions:
+        session_id = session['session_id']
+        session_short = session_id[:8] + '...' if len(session_id) > 12 else session_id
+        write(f"| {session_short} | {session['model']} | {session['input_tokens']:,} | {session['output_tokens']:,} | {session['cache_read']:,} | ${session['cost']:.4f} |\n")
     
-    return '\n'.join(report)
+    if stats['total_sessions'] > len(sessions):
+        write(f"\n*Showing {len(sessions)} of {stats['total_sessions']} sessions*\n")
 
 
 def generate_report(db_path, output_path=None):
     """Generate a full report from the database."""
     conn = sqlite3.connect(db_path)
+    # Read-only run: big page cache, mmap I/O and in-memory temp sorts
+    conn.execute('PRAGMA query_only=ON')
+    conn.execute('PRAGMA cache_size=-131072')
+    conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA temp_store=MEMORY')
     cursor = conn.cursor()
     
     stats = get_summary_stats(cursor)
-    sessions = get_session_details(cursor)
+    sessions = get_session_details(cursor, limit=SESSION_DETAIL_LIMIT)
     cache_metrics = calculate_cache_metrics(cursor)
     
-    report = generate_markdown_report(stats, sessions, cache_metrics)
-    
     if output_path:
         with open(output_path, 'w') as f:
-            f.write(report)
+            generate_markdown_report(stats, sessions, cache_metrics, f)
         print(f"Report saved to: {output_path}")
     else:
-        print(report)
+        generate_markdown_report(stats, sessions, cache_metrics, sys.stdout)
     
     conn.close()
 
@@ -4,19 +4,32 @@ Generate timeline visualization from local SQLite metrics database.
 
 Usage:
     python generate_timeline.py [--db <database_file>] [--output <output_file>]
+                                [--format text|html|csv] [--no-cumulative]
     
 Example:
     python generate_timeline.py --db ~/claude_metrics.db --output timeline.html
 """
 
+import csv
+import sys
 import sqlite3
 import argparse
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 
+# Number of most recent token records shown in the HTML timeline
+HTML_TIMELINE_LIMIT = 100
 
-def get_timeline_data(cursor):
-    """Get timeline data for all sessions."""
+# Write buffer for timeline output files
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+
+def get_timeline_data(cursor, limit):
+    """Get the most recent timeline rows across all sessions, oldest first."""
+    # Walk the timestamp index backwards so only `limit` rows are read.
+    # Rows of one metric share a timestamp; breaking ties on id keeps
+    # them in insertion order once reversed, with or without the index
     cursor.execute('''
         SELECT 
             t.timestamp,
@@ -25,16 +38,17 @@ def get_timeline_data(cursor):
             t.value,
             t.model
         FROM token_usage t
-        ORDER BY t.timestamp
-    ''')
+        ORDER BY t.timestamp DESC, t.id DESC
+        LIMIT ?
+    ''', (limit,))
     
-    return cursor.fetchall()
+    rows = cursor.fetchall()
+    rows.reverse()
+    return rows
 
 
-def generate_text_timeline(cursor):
-    """Generate a text-based timeline."""
-    timeline = []
-    
+def generate_text_timeline(cursor, out):
+    """Write a text-based timeline to out."""
     cursor.execute('''
         SELECT 
             t.timestamp,
@@ -46,23 +60,23 @@ def generate_text_timeline(cursor):
         ORDER BY t.timestamp
     ''')
     
-    timeline.append("=" * 80)
-    timeline.append("CLAUDE CODE METRICS TIMELINE")
-    timeline.append("=" * 80)
-    timeline.append("")
+    out.write("=" * 80 + "\n")
+    out.write("CLAUDE CODE METRICS TIMELINE\n")
+    out.write("=" * 80 + "\n")
+    out.write("\n")
     
     current_session = None
-    for row in cursor.fetchall():
+    for row in cursor:
         timestamp, session_id, model, tokens = row
         
         if session_id != current_session:
             current_session = session_id
-            timeline.append(f"\n{'─' * 40}")
-            timeline.append(f"SESSION: {session_id[:16]}...")
-            timeline.append(f"MODEL: {model}")
-            timeline.append(f"{'─' * 40}")
+            out.write(f"\n{'─' * 40}\n")
+            out.write(f"SESSION: {session_id[:16]}...\n")
+            out.write(f"MODEL: {model}\n")
+            out.write(f"{'─' * 40}\n")
         
-        timeline.append(f"  [{timestamp}] {tokens}")
+        out.write(f"  [{timestamp}] {tokens}\n")
     
     # Add summary
     cursor.execute('''
@@ -73,40 +87,48 @@ def generate_text_timeline(cursor):
         GROUP BY token_type
     ''')
     
-    timeline.append("\n" + "=" * 80)
-    timeline.append("SUMMARY")
-    timeline.append("=" * 80)
-    for row in cursor.fetchall():
-        timeline.append(f"  {row[0]}: {row[1]:,} tokens")
-    
-    return '\n'.join(timeline)
+    out.write("\n" + "=" * 80 + "\n")
+    out.write("SUMMARY\n")
+    out.write("=" * 80 + "\n")
+    for row in cursor:
+        out.write(f"  {row[0]}: {row[1]:,} tokens\n")
 
 
-def generate_csv_timeline(cursor):
-    """Generate CSV export of timeline data."""
-    csv_lines = ['timestamp,session_id,model,token_type,value,cumulative']
+def generate_csv_timeline(cursor, out, cumulative=True):
+    """Write a CSV export of timeline data to out.
     
-    cursor.execute('''
-        SELECT 
-            t.timestamp,
-            t.session_id,
-            t.model,
-            t.token_type,
-            t.value,
-            SUM(t.value) OVER (PARTITION BY t.token_type ORDER BY t.timestamp) as cumulative
-        FROM token_usage t
-        ORDER BY t.timestamp
-    ''')
+    The running per-type total needs a window function (and so a sort),
+    so it is only computed when cumulative is set.
+    """
+    writer = csv.writer(out, lineterminator='\n')
     
-    for row in cursor.fetchall():
-        csv_lines.append(','.join(str(x) for x in row))
+    if cumulative:
+        writer.writerow(['timestamp', 'session_id', 'model', 'token_type', 'value', 'cumulative'])
+        cursor.execute('''
+            SELECT 
+                t.timestamp,
+                t.session_id,
+                t.model,
+                t.token_type,
+                t.value,
+                SUM(t.value) OVER (PARTITION BY t.token_type ORDER BY t.timestamp) as cumulative
+            FROM token_usage t
+            ORDER BY t.timestamp
+        ''')
+    else:
+        writer.writerow(['timestamp', 'session_id', 'model', 'token_type', 'value'])
+        cursor.execute('''
+            SELECT timestamp, session_id, model, token_type, value
+            FROM token_usage
+            ORDER BY timestamp
+        ''')
     
-    return '\n'.join(csv_lines)
+    writer.writerows(cursor)
 
 
-def generate_html_timeline(cursor):
-    """Generate an HTML timeline with basic visualization."""
-    timeline_data = get_timeline_data(cursor)
+def generate_html_timeline(cursor, out):
+    """Write an HTML timeline with basic visualization to out."""
+    timeline_data = get_timeline_data(cursor, HTML_TIMELINE_LIMIT)
     
     # Get totals for chart
     cursor.execute('''
@@ -116,7 +138,7 @@ def generate_html_timeline(cursor):
     ''')
     totals = dict(cursor.fetchall())
     
-    html = '''<!DOCTYPE html>
+    out.write('''<!DOCTYPE html>
 <html>
 <head>
     <title>Claude Code Metrics Timeline</title>
@@ -151,41 +173,41 @@ def generate_html_timeline(cursor):
     </div>
     
     <div class="summary">
-'''
+''')
     
     # Add summary boxes
     for token_type, total in totals.items():
-        html += f'''
+        out.write(f'''
         <div class="stat-box">
             <div class="stat-value">{total:,}</div>
             <div class="stat-label">{token_type} tokens</div>
         </div>
-'''
+''')
     
-    html += '''
+    out.write('''
     </div>
     
     <h2>Token Distribution</h2>
     <div class="bar-chart">
-'''
+''')
     
     # Add bar chart
     max_val = max(totals.values()) if totals else 1
     for token_type, total in totals.items():
         width = (total / max_val) * 100
-        html += f'        <div class="bar bar-{token_type}" style="width: {max(width, 5)}%">{token_type}: {total:,}</div>\n'
+        out.write(f'        <div class="bar bar-{token_type}" style="width: {max(width, 5)}%">{token_type}: {total:,}</div>\n')
     
-    html += '''
+    out.write('''
     </div>
     
     <h2>Timeline</h2>
     <div class="timeline">
-'''
+''')
     
-    # Add timeline items (limit to last 100)
-    for row in timeline_data[-100:]:
+    # Add timeline items
+    for row in timeline_data:
         timestamp, session_id, token_type, value, model = row
-        html += f'''
+        out.write(f'''
         <div class="timeline-item">
             <div class="timeline-time">{timestamp}</div>
             <div class="timeline-content">
@@ -193,35 +215,40 @@ def generate_html_timeline(cursor):
                 <small style="color: #999">({model})</small>
             </div>
         </div>
-'''
+''')
     
-    html += '''
+    out.write('''
     </div>
 </body>
 </html>
-'''
-    
-    return html
+''')
 
 
-def generate_timeline(db_path, output_path=None, format='text'):
+def generate_timeline(db_path, output_path=None, format='text', cumulative=True):
     """Generate timeline from the database."""
     conn = sqlite3.connect(db_path)
+    # Read-only run: big page cache, mmap I/O and in-memory temp sorts
+    conn.execute('PRAGMA query_only=ON')
+    conn.execute('PRAGMA cache_size=-131072')
+    conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA temp_store=MEMORY')
     cursor = conn.cursor()
     
     if format == 'html':
-        content = generate_html_timeline(cursor)
+        write_timeline = generate_html_timeline
     elif format == 'csv':
-        content = generate_csv_timeline(cursor)
+        write_timeline = partial(generate_csv_timeline, cumulative=cumulative)
     else:
-        content = generate_text_timeline(cursor)
+        write_timeline = generate_text_timeline
     
     if output_path:
-        with open(output_path, 'w') as f:
-            f.write(content)
+        # csv.writer emits its own line endings, so disable translation
+        newline = '' if format == 'csv' else None
+        with open(output_path, 'w', newline=newline, buffering=OUTPUT_BUFFER_SIZE) as f:
+            write_timeline(cursor, f)
         print(f"Timeline saved to: {output_path}")
     else:
-        print(content)
+        write_timeline(cursor, sys.stdout)
     
     conn.close()
 
@@ -235,6 +262,8 @@ def main():
     parser.add_argument('--output', '-o', help='Output file path (default: print to stdout)')
     parser.add_argument('--format', '-f', choices=['text', 'html', 'csv'], default='text',
                         help='Output format (default: text)')
+    parser.add_argument('--cumulative', action=argparse.BooleanOptionalAction, default=True,
+                        help='Include running per-type totals in CSV output (default: on)')
     
     args = parser.parse_args()
     
@@ -246,7 +275,8 @@ def main():
         print("Run parse_otel_metrics.py first to create the database.")
         return 1
     
-    generate_timeline(str(db_path), str(output_path) if output_path else None, args.format)
+    generate_timeline(str(db_path), str(output_path) if output_path else None, args.format,
+                      args.cumulative)
     return 0
 
 
@@ -3,40 +3,137 @@
 Parse OTEL console output and store metrics in SQLite database.
 
 Usage:
-    python parse_otel_metrics.py <log_file> [--db <database_file>]
+    python parse_otel_metrics.py <log_file> [--db <database_file>] [--debug-raw]
     
 Example:
     python parse_otel_metrics.py ~/claude_metrics.log --db ~/claude_metrics.db
 """
 
+import os
 import re
+import mmap
 import json
 import sqlite3
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
 
+# orjson is optional; it decodes metrics several times faster
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# One pass over console (JavaScript object literal) output, matching in order:
+# single-quoted strings, double-quoted strings, unquoted keys and trailing
+# commas. Strings are consumed whole so their contents are never rewritten.
+_JS_TOKEN = re.compile(r"""'((?:[^'\\]|\\.)*)'|("(?:[^"\\]|\\.)*")|(\w+)\s*:|,(\s*[}\]])""")
+
+# A metric block opens with '{' and whitespace before its descriptor key;
+# braces are then matched to find where it ends
+_METRIC_KEY = b'descriptor:'
+_OPEN_BRACE = ord('{')
+_WHITESPACE = b' \t\n\r\f\v'
+_BRACE = re.compile(rb'[{}]')
+
+# Blocks handed to the parse worker pool per round
+PARSE_WINDOW = 16384
+
+# Smallest log worth a worker pool; below this, starting the workers
+# costs more than parsing the blocks in-process
+PARALLEL_PARSE_MIN_BYTES = 8 << 20
+
+# Metrics collected before their rows are flushed to SQLite
+METRIC_BATCH_SIZE = 1000
+
+# Destination table for each Claude Code metric name (None: sessions only).
+# Names not listed are classified by keyword in metric_table().
+_METRIC_TABLE = {
+    'claude_code.token.usage': 'token_usage',
+    'claude_code.cost.usage': 'cost_usage',
+    'claude_code.active_time.total': 'active_time',
+    'claude_code.commit.count': 'code_activity',
+    'claude_code.pull_request.count': 'code_activity',
+    'claude_code.lines_of_code.count': 'code_activity',
+    'claude_code.session.count': None,
+    'claude_code.code_edit_tool.decision': None,
+}
+
+# Fallback for names not listed above: the first entry with a keyword in
+# the lowercased name decides the table
+_METRIC_KEYWORDS = (
+    (('token',), 'token_usage'),
+    (('cost',), 'cost_usage'),
+    (('active_time',), 'active_time'),
+    (('commit', 'pull_request', 'lines_of_code'), 'code_activity'),
+)
+
+# INSERT statement per table, in load order (sessions first)
+INSERT_SQL = {
+    'sessions': '''
+        INSERT OR IGNORE INTO sessions (session_id, user_id, model, started_at)
+        VALUES (?, ?, ?, ?)
+    ''',
+    'token_usage': '''
+        INSERT INTO token_usage (session_id, timestamp, model, token_type, value)
+        VALUES (?, ?, ?, ?, ?)
+    ''',
+    'cost_usage': '''
+        INSERT INTO cost_usage (session_id, timestamp, model, value)
+        VALUES (?, ?, ?, ?)
+    ''',
+    'active_time': '''
+        INSERT INTO active_time (session_id, timestamp, value)
+        VALUES (?, ?, ?)
+    ''',
+    'code_activity': '''
+        INSERT INTO code_activity (session_id, timestamp, activity_type, value)
+        VALUES (?, ?, ?, ?)
+    ''',
+    'raw_metrics': '''
+        INSERT INTO raw_metrics (timestamp, metric_name, raw_json)
+        VALUES (?, ?, ?)
+    ''',
+}
+
 
 def create_database(db_path):
-    """Create SQLite database with schema for OTEL metrics."""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    """Create SQLite database with the OTEL metrics tables.
     
-    # Create tables
-    cursor.executescript('''
-        -- Sessions table
+    Indexes are left to create_indexes() so a bulk load into a new
+    database does not maintain them row by row.
+    """
+    conn = sqlite3.connect(db_path)
+    create_tables(conn)
+    conn.commit()
+    return conn
+
+
+def create_tables(conn):
+    """Create the OTEL metrics tables if they do not exist."""
+    conn.executescript('''
+        -- Sessions table, clustered on its natural key so lookups and
+        -- INSERT OR IGNORE touch a single B-tree
         CREATE TABLE IF NOT EXISTS sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT UNIQUE,
+            session_id TEXT PRIMARY KEY,
             user_id TEXT,
             model TEXT,
             started_at TIMESTAMP,
             ended_at TIMESTAMP
-        );
+        ) WITHOUT ROWID;
+        
+        -- Metric tables have no natural key (one export can hold several
+        -- points with the same session, type and timestamp), so they keep a rowid;
+        -- it is not AUTOINCREMENT to skip sqlite_sequence updates per insert
         
         -- Token usage table
         CREATE TABLE IF NOT EXISTS token_usage (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id INTEGER PRIMARY KEY,
             session_id TEXT,
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             model TEXT,
@@ -47,7 +144,7 @@ def create_database(db_path):
         
         -- Cost usage table
         CREATE TABLE IF NOT EXISTS cost_usage (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id INTEGER PRIMARY KEY,
             session_id TEXT,
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             model TEXT,
@@ -57,7 +154,7 @@ def create_database(db_path):
         
         -- Active time table
         CREATE TABLE IF NOT EXISTS active_time (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id INTEGER PRIMARY KEY,
             session_id TEXT,
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             value REAL,  -- seconds
@@ -66,7 +163,7 @@ def create_database(db_path):
         
         -- Code activity table
         CREATE TABLE IF NOT EXISTS code_activity (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id INTEGER PRIMARY KEY,
             session_id TEXT,
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             activity_type TEXT,  -- commit, pull_request, lines_of_code
@@ -74,154 +171,321 @@ def create_database(db_path):
             FOREIGN KEY (session_id) REFERENCES sessions(session_id)
         );
         
-        -- Raw metrics table (for debugging)
+        -- Raw metrics table (for debugging, filled only with --debug-raw)
         CREATE TABLE IF NOT EXISTS raw_metrics (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            id INTEGER PRIMARY KEY,
+            timestamp TIMESTAMP,
             metric_name TEXT,
             raw_json TEXT
         );
-        
-        -- Create indexes
+    ''')
+
+
+def create_indexes(conn):
+    """Create the OTEL metrics indexes if they do not exist."""
+    conn.executescript('''
         CREATE INDEX IF NOT EXISTS idx_token_session ON token_usage(session_id);
         CREATE INDEX IF NOT EXISTS idx_token_type ON token_usage(token_type);
+        CREATE INDEX IF NOT EXISTS idx_token_timestamp ON token_usage(timestamp);
         CREATE INDEX IF NOT EXISTS idx_cost_session ON cost_usage(session_id);
         CREATE INDEX IF NOT EXISTS idx_activity_session ON code_activity(session_id);
     ''')
-    
-    conn.commit()
-    return conn
 
 
-def parse_metric_block(block):
-    """Parse a single metric block from console output."""
+def _to_json_token(match):
+    """Rewrite one _JS_TOKEN match into its JSON equivalent."""
+    group = match.lastindex
+    if group == 3:
+        # Unquoted key
+        return f'"{match[3]}":'
+    if group == 1:
+        # Single-quoted string: requote, fixing up embedded quotes
+        return '"' + match[1].replace("\\'", "'").replace('"', '\\"') + '"'
+    # Double-quoted string (kept as is) or trailing comma (dropped)
+    return match[group]
+
+
+def normalize_metric_block(block):
+    """Rewrite a metric block from console output as JSON text."""
+    # Clean up JavaScript-style output to valid JSON in a single pass
+    return _JS_TOKEN.sub(_to_json_token, block)
+
+
+def _load_metric_json(cleaned):
+    """Decode normalized metric JSON, returning None if it is invalid."""
+    try:
+        return _json_loads(cleaned)
+    except json.JSONDecodeError:
+        # orjson.JSONDecodeError subclasses this too
+        if _json_loads is json.loads:
+            return None
+    # orjson rejects the NaN and Infinity values console output can hold;
+    # retry with the stdlib decoder so results don't depend on orjson
     try:
-        # Clean up JavaScript-style output to valid JSON
-        # Replace single quotes with double quotes
-        cleaned = block.replace("'", '"')
-        # Handle unquoted keys
-        cleaned = re.sub(r'(\w+):', r'"\1":', cleaned)
-        # Handle trailing commas
-        cleaned = re.sub(r',(\s*[}\]])', r'\1', cleaned)
-        
         return json.loads(cleaned)
     except json.JSONDecodeError:
         return None
 
 
-def extract_metrics_from_log(log_content):
-    """Extract all metric blocks from log file content."""
-    metrics = []
+def parse_metric_block(block):
+    """Parse a single metric block from console output."""
+    return _load_metric_json(normalize_metric_block(block))
+
+
+def find_block_end(buf, start, stop=None):
+    """Return the index just past the brace that closes the one at start.
     
-    # Split by metric markers and parse
-    blocks = re.split(r'(?=\{\s*descriptor:)', log_content)
+    Only buf[start:stop] is scanned. Returns None if the braces do not
+    balance within it (e.g. a truncated block).
+    """
+    # Jump between braces with the regex engine instead of stepping
+    # through every character in Python
+    brace_count = 0
+    matches = _BRACE.finditer(buf, start) if stop is None else _BRACE.finditer(buf, start, stop)
+    for match in matches:
+        if match[0] == b'{':
+            brace_count += 1
+        else:
+            brace_count -= 1
+            if brace_count == 0:
+                return match.end()
+    return None
+
+
+def find_metric_start(buf, pos=0):
+    """Return the index of the next metric block's '{' at or after pos, or -1."""
+    # The descriptor key is rare in the log, so find it with the C-level
+    # search and walk back over whitespace to its brace
+    while True:
+        key = buf.find(_METRIC_KEY, pos)
+        if key == -1:
+            return -1
+        i = key - 1
+        while i >= pos and buf[i] in _WHITESPACE:
+            i -= 1
+        if i >= pos and buf[i] == _OPEN_BRACE:
+            return i
+        pos = key + len(_METRIC_KEY)
+
+
+def iter_metric_blocks(buf):
+    """Yield the text of each metric block in a bytes-like buffer.
     
-    for block in blocks:
-        if 'descriptor:' in block:
-            # Find the complete JSON object
-            brace_count = 0
-            start = block.find('{')
-            if start == -1:
-                continue
-                
-            end = start
-            for i, char in enumerate(block[start:], start):
-                if char == '{':
-                    brace_count += 1
-                elif char == '}':
-                    brace_count -= 1
-                    if brace_count == 0:
-                        end = i + 1
-                        break
-            
-            metric_str = block[start:end]
-            parsed = parse_metric_block(metric_str)
-            if parsed:
-                metrics.append(parsed)
+    Meant to run over an mmap of the log: blocks are found on the raw
+    bytes and only each block's own slice is copied and decoded.
+    """
+    start = find_metric_start(buf)
+    while start != -1:
+        # A block may not run into the next one; if it does, it was
+        # truncated and is skipped
+        next_start = find_metric_start(buf, start + 1)
+        stop = next_start if next_start != -1 else len(buf)
+        end = find_block_end(buf, start, stop)
+        if end is not None:
+            yield buf[start:end].decode('utf-8', errors='replace')
+        start = next_start
+
+
+@contextmanager
+def map_log_file(log_path):
+    """Memory-map a log file read-only, yielding a bytes-like buffer."""
+    with open(log_path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and non-regular files (e.g. pipes) cannot be mapped
+            yield f.read()
+            return
+        with mm:
+            # Pages are scanned front to back; let the kernel read ahead
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            yield mm
+
+
+def _parse_metric_block_with_json(block):
+    """Return (metric_json, parsed) for a block; runs in pool workers."""
+    metric_json = normalize_metric_block(block)
+    return metric_json, _load_metric_json(metric_json)
+
+
+def iter_metrics_from_log(log_buf, executor=None, store_raw=False):
+    """Yield (metric_json, parsed) for each metric in a log's raw bytes.
+    
+    With store_raw, metric_json is the block normalized to JSON text,
+    which is what raw_metrics stores, so it never has to be re-encoded;
+    otherwise it is None and workers send back only the parsed dict.
+    With an executor, blocks are parsed in its workers, PARSE_WINDOW at
+    a time so the whole log is never queued at once; results keep log order.
+    """
+    parse = _parse_metric_block_with_json if store_raw else parse_metric_block
+    blocks = iter_metric_blocks(log_buf)
+    if executor is None:
+        results = map(parse, blocks)
+    else:
+        results = (
+            result
+            for window in iter(lambda: list(islice(blocks, PARSE_WINDOW)), [])
+            for result in executor.map(parse, window, chunksize=64)
+        )
     
-    return metrics
+    if store_raw:
+        for metric_json, parsed in results:
+            if parsed:
+                yield metric_json, parsed
+    else:
+        for parsed in results:
+            if parsed:
+                yield None, parsed
+
+
+def new_row_batches():
+    """Return empty per-table row lists for collect_metric_rows."""
+    return {table: [] for table in INSERT_SQL}
+
+
+def metric_table(metric_name):
+    """Return the table a metric's data points belong in, or None."""
+    try:
+        return _METRIC_TABLE[metric_name]
+    except KeyError:
+        return _classify_metric_name(metric_name)
+
 
+@lru_cache(maxsize=256)
+def _classify_metric_name(metric_name):
+    """Pick a table for an unrecognised metric name by keyword."""
+    name = metric_name.lower()
+    return next(
+        (table for keywords, table in _METRIC_KEYWORDS
+         if any(keyword in name for keyword in keywords)),
+        None
+    )
 
-def store_metric(conn, metric, timestamp=None):
-    """Store a parsed metric in the database."""
+
+def collect_metric_rows(metric, rows, timestamp=None, raw_json=None, seen_sessions=None):
+    """Append the row tuples for a parsed metric to the per-table rows lists.
+    
+    A raw_metrics row is only added when the metric's raw_json is given.
+    If seen_sessions is given, sessions rows are only added for session
+    IDs not in it, and new IDs are added to it.
+    """
     if not metric or 'descriptor' not in metric:
         return
     
-    cursor = conn.cursor()
+    # One clock read per metric, shared by all its rows. Not coarser:
+    # the timeline groups rows into events by timestamp and the CSV
+    # running totals order on it, so each metric keeps its own stamp
     timestamp = timestamp or datetime.now().isoformat()
     
     descriptor = metric.get('descriptor', {})
     metric_name = descriptor.get('name', '')
     data_points = metric.get('dataPoints', [])
+    table = metric_table(metric_name)
     
     # Store raw metric for debugging
-    cursor.execute(
-        'INSERT INTO raw_metrics (timestamp, metric_name, raw_json) VALUES (?, ?, ?)',
-        (timestamp, metric_name, json.dumps(metric))
-    )
+    if raw_json is not None:
+        rows['raw_metrics'].append((timestamp, metric_name, raw_json))
+    
+    # Invariant across the data points, so resolve them once
+    table_rows = rows[table] if table else None
+    session_rows = rows['sessions']
+    activity_type = metric_name.rsplit('.', 1)[-1]
     
     for dp in data_points:
         attrs = dp.get('attributes', {})
-        session_id = attrs.get('session.id', attrs.get('session_id', 'unknown'))
-        user_id = attrs.get('user.id', attrs.get('user_id', 'unknown'))
+        # Inline lookups with the older underscore spelling as fallback;
+        # a null ID becomes 'unknown' since sessions are keyed on it
+        session_id = attrs.get('session.id')
+        if session_id is None:
+            session_id = attrs.get('session_id')
+            if session_id is None:
+                session_id = 'unknown'
         model = attrs.get('model', 'unknown')
         value = dp.get('value', 0)
         
-        # Ensure session exists
-        cursor.execute('''
-            INSERT OR IGNORE INTO sessions (session_id, user_id, model, started_at)
-            VALUES (?, ?, ?, ?)
-        ''', (session_id, user_id, model, timestamp))
+        # Ensure session exists; the user ID is only needed for its row
+        if seen_sessions is None or session_id not in seen_sessions:
+            user_id = attrs.get('user.id')
+            if user_id is None:
+                user_id = attrs.get('user_id')
+                if user_id is None:
+                    user_id = 'unknown'
+            session_rows.append((session_id, user_id, model, timestamp))
+            if seen_sessions is not None:
+                seen_sessions.add(session_id)
         
         # Store based on metric type
-        if 'token' in metric_name.lower():
+        if table == 'token_usage':
             token_type = attrs.get('type', 'unknown')
-            cursor.execute('''
-                INSERT INTO token_usage (session_id, timestamp, model, token_type, value)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (session_id, timestamp, model, token_type, value))
+            table_rows.append((session_id, timestamp, model, token_type, value))
             
-        elif 'cost' in metric_name.lower():
-            cursor.execute('''
-                INSERT INTO cost_usage (session_id, timestamp, model, value)
-                VALUES (?, ?, ?, ?)
-            ''', (session_id, timestamp, model, value))
+        elif table == 'cost_usage':
+            table_rows.append((session_id, timestamp, model, value))
             
-        elif 'active_time' in metric_name.lower():
-            cursor.execute('''
-                INSERT INTO active_time (session_id, timestamp, value)
-                VALUES (?, ?, ?)
-            ''', (session_id, timestamp, value))
+        elif table == 'active_time':
+            table_rows.append((session_id, timestamp, value))
             
-        elif any(x in metric_name.lower() for x in ['commit', 'pull_request', 'lines_of_code']):
-            activity_type = metric_name.split('.')[-1] if '.' in metric_name else metric_name
-            cursor.execute('''
-                INSERT INTO code_activity (session_id, timestamp, activity_type, value)
-                VALUES (?, ?, ?, ?)
-            ''', (session_id, timestamp, activity_type, value))
+        elif table == 'code_activity':
+            table_rows.append((session_id, timestamp, activity_type, value))
+
+
+def store_rows(conn, rows):
+    """Insert collected rows with one executemany per table.
     
-    conn.commit()
+    Does not commit; the caller owns the surrounding transaction.
+    """
+    cursor = conn.cursor()
+    for table, sql in INSERT_SQL.items():
+        if rows[table]:
+            cursor.executemany(sql, rows[table])
 
 
-def parse_log_file(log_path, db_path):
+def parse_log_file(log_path, db_path, store_raw=False):
     """Parse a log file and store metrics in database."""
     print(f"Parsing log file: {log_path}")
     print(f"Database: {db_path}")
     
-    with open(log_path, 'r') as f:
-        content = f.read()
-    
     conn = create_database(db_path)
-    metrics = extract_metrics_from_log(content)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')
     
-    print(f"Found {len(metrics)} metric blocks")
+    # Sessions already stored need no further INSERT OR IGNORE round trips
+    cursor = conn.cursor()
+    cursor.execute('SELECT session_id FROM sessions')
+    seen_sessions = {row[0] for row in cursor.fetchall()}
     
-    for metric in metrics:
-        store_metric(conn, metric)
+    metric_count = 0
+    rows = new_row_batches()
+    with map_log_file(log_path) as log_buf:
+        # Block parsing is CPU-bound, so fan large logs out when there are
+        # cores to spare; this process stays the only SQLite writer
+        workers = os.cpu_count() or 1
+        if workers > 1 and len(log_buf) >= PARALLEL_PARSE_MIN_BYTES:
+            executor = ProcessPoolExecutor(workers)
+        else:
+            executor = None
+        
+        # Store every metric in one transaction so SQLite syncs once per file
+        with conn, executor or nullcontext():
+            for metric_json, metric in iter_metrics_from_log(log_buf, executor, store_raw):
+                collect_metric_rows(metric, rows, raw_json=metric_json,
+                                    seen_sessions=seen_sessions)
+                metric_count += 1
+                if metric_count % METRIC_BATCH_SIZE == 0:
+                    store_rows(conn, rows)
+                    rows = new_row_batches()
+            store_rows(conn, rows)
     
-    # Print summary
-    cursor = conn.cursor()
+    # Built after the load so a fresh database indexes in one pass;
+    # existing indexes are simply kept up to date during the load
+    create_indexes(conn)
     
+    print(f"Found {metric_count} metric blocks")
+    
+    # Print summary
     cursor.execute('SELECT COUNT(DISTINCT session_id) FROM sessions')
     session_count = cursor.fetchone()[0]
     
@@ -247,6 +511,8 @@ def main():
     parser.add_argument('log_file', help='Path to log file with OTEL console output')
     parser.add_argument('--db', default='~/.claude-metrics/metrics.db',
                         help='Path to SQLite database file')
+    parser.add_argument('--debug-raw', action='store_true',
+                        help='Also keep each metric\'s normalized JSON in the raw_metrics table')
     
     args = parser.parse_args()
     
@@ -260,7 +526,7 @@ def main():
         print(f"Error: Log file not found: {log_path}")
         return 1
     
-    parse_log_file(str(log_path), str(db_path))
+    parse_log_file(str(log_path), str(db_path), store_raw=args.debug_raw)
     return 0
 
 